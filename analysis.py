@@ -0,0 +1,526 @@
+import streamlit as st
+import pandas as pd
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import re
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from hashlib import blake2b
+from urllib.parse import quote_plus
+
+# -------------------------------
+# 1. Load JSON mapping files
+# -------------------------------
+@st.cache_data
+def load_cgt_mapping():
+    with open("merged_cgt_mapping.json", "r") as f:
+        return {k.strip().casefold(): v for k, v in json.load(f).items()}
+
+@st.cache_data
+def load_age_mapping():
+    # Onset strings are only ever keyword-matched, so fold them here too
+    with open("infant_mapping.json", "r") as f:
+        return {k.strip().casefold(): v.casefold() for k, v in json.load(f).items()}
+
+@st.cache_data
+def load_approved_cgt():
+    # Grouped by condition, so checking a record is one dict probe instead of a scan of the list
+    approved = {}
+    with open("approved_cgt.json", "r") as f:
+        for p in json.load(f):
+            approved.setdefault(p["condition"].strip().casefold(), []).append(p)
+    return approved
+
+cgt_map = load_cgt_mapping()
+age_map = load_age_mapping()
+approved_cgt_map = load_approved_cgt()
+
+@lru_cache(maxsize=1024)
+def _lc(s):
+    # Conditions repeat across many rows, so memoize their casefolded form
+    return s.strip().casefold() if isinstance(s, str) else ""
+
+# -------------------------------
+# 2. Infant inclusion logic
+# -------------------------------
+# Every text check below needs one of these substrings to match
+_INFANT_TOKENS = ("infant", "newborn", "birth", "month", "year", "0")
+
+# Direct inclusion patterns (for Include infants only if upper bound ≤ 2 years), fused into one scan
+_INCLUDE_PATTERNS = [
+    r"(?:from|starting at|age)\s*(?:0|birth|newborns?|infants?)",
+    r"(?:less than|<|up to)\s*(?:1[28]?|24?)\s*(?:months?|years?)",
+    r"\b(?:newborns?|infants?)\b"
+]
+_INCLUDE_RE = re.compile("|".join(f"(?:{p})" for p in _INCLUDE_PATTERNS))
+_AGE_RANGE_RE = re.compile(r"(?P<lo>\d+)\s*(?P<lo_unit>months?|years?)\s*(?:to|-)\s*(?P<hi>\d+)\s*(?P<hi_unit>months?|years?)")
+_AGE_RE = re.compile(r"(?P<val>\d+)\s*(?P<unit>months?|years?)")
+_EXCLUDE_RE = re.compile(r"(?:does not include infants|exclude infants|no infants|not include infants)")
+
+# Age-of-onset keywords, each list fused into one literal alternation
+_ONSET_LIKELY_RE = re.compile("|".join(map(re.escape, ("birth", "infant", "neonate", "0-2 years", "0-12 months", "0-24 months"))))
+_ONSET_UNLIKELY_RE = re.compile("|".join(map(re.escape, ("toddler", "child", "3 years", "4 years"))))
+
+# Registry columns joined into the text the suggestions are drawn from
+SUGGESTION_TEXT_COLS = ["Population (use drop down list)", "Conditions", "Study Title", "Brief Summary"]
+
+def _in_years(vals, units):
+    # int() rather than pd.to_numeric: \d also matches non-ASCII digits such as "٣" or "１２"
+    return vals.map(int, na_action="ignore").astype(float) / np.where(units.str.startswith("month", na=False), 12, 1)
+
+def classify_infant_inclusion(text_lower, conditions):
+    # Python re semantics for every row: Arrow-backed strings would route the patterns through RE2
+    text_lower = text_lower.astype(object)
+
+    # Cheap substring gate: rows without any token (e.g. empty summaries) skip the regex work
+    gated = np.logical_or.reduce([text_lower.str.contains(t, regex=False) for t in _INFANT_TOKENS])
+    text = text_lower[gated]
+
+    # 1. Direct inclusion patterns
+    include = text.str.contains(_INCLUDE_RE)
+
+    # 2. Numeric age ranges: the first range decides
+    rng = text.str.extract(_AGE_RANGE_RE)
+    has_rng = rng["lo"].notna()
+    rng_lo_infant = _in_years(rng["lo"], rng["lo_unit"]) <= 2
+    rng_hi_infant = _in_years(rng["hi"], rng["hi_unit"]) <= 2
+
+    # 3. Standalone age fallback: the first age decides
+    age = text.str.extract(_AGE_RE)
+    has_age = age["val"].notna()
+    age_infant = _in_years(age["val"], age["unit"]) <= 2
+
+    # 4. Explicit exclusion check
+    exclude = text.str.contains(_EXCLUDE_RE)
+
+    # Earlier conditions win, mirroring the order of the checks above
+    suggestion = pd.Series(np.select(
+        [
+            include,
+            has_rng & rng_lo_infant & rng_hi_infant,
+            has_rng & rng_lo_infant,
+            has_rng,
+            has_age & age_infant,
+            has_age,
+            exclude
+        ],
+        [
+            "Include infants",
+            "Include infants",
+            "Likely to include infants",
+            "Does not include infants",
+            "Likely to include infants",
+            "Does not include infants",
+            "Does not include infants"
+        ],
+        default=""
+    ), index=text.index, dtype=object).reindex(text_lower.index, fill_value="")
+
+    # 5. Age of onset mapping, looked up only for rows the text left undecided
+    undecided = suggestion == ""
+    onset = conditions[undecided].map(_lc).map(age_map).fillna("").astype(object)
+    suggestion[undecided] = np.select(
+        [
+            onset.str.contains(_ONSET_LIKELY_RE),
+            onset.str.contains(_ONSET_UNLIKELY_RE)
+        ],
+        [
+            "Likely to include infants",
+            "Unlikely to include infants but possible"
+        ],
+        default="Uncertain"
+    )
+    return suggestion
+
+def precompute_suggestions(df):
+    """Add the lowercased study text, infant suggestion and CGT keyword hit for every row of an uploaded sheet."""
+    text = df.reindex(columns=SUGGESTION_TEXT_COLS).astype(object).fillna("").astype(str)
+    df["_study_text"] = text[SUGGESTION_TEXT_COLS[0]].str.cat(
+        [text[c] for c in SUGGESTION_TEXT_COLS[1:]], sep=" ").str.lower()
+    df["_suggested_infant"] = classify_infant_inclusion(df["_study_text"], df["Conditions"])
+    df["_cgt_keyword"] = df["_study_text"].map(has_cgt_keyword).astype(bool)
+
+# -------------------------------
+# 3. ClinicalTrials.gov API
+# -------------------------------
+_SESSION = requests.Session()
+_SESSION.headers["Accept-Encoding"] = "gzip, deflate"
+# ClinicalTrials.gov throttles bursts, so back off between attempts. Each wait holds a _CT_SLOTS
+# slot that the record on screen may need, so waits are capped: Retry-After (urllib3 allows up
+# to 6 hours) is ignored and a timed-out read is retried only once.
+_SESSION.mount("https://clinicaltrials.gov/", HTTPAdapter(
+    max_retries=Retry(
+        total=3,
+        read=1,
+        backoff_factor=0.5,
+        backoff_max=2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=False
+    )
+))
+# Concurrent ClinicalTrials.gov requests across all sessions and lookup threads
+_CT_SLOTS = threading.Semaphore(6)
+
+CT_API_URL = "https://clinicaltrials.gov/api/v2/studies"
+# Studies shown per condition, and the fields needed to display them
+CT_PAGE_SIZE = 3
+CT_FIELDS = "NCTId,BriefTitle,Phase,OverallStatus,ContactsLocationsModule"
+# Locations listed per study; multi-site trials can have hundreds
+CT_MAX_LOCATIONS = 5
+# Lookups are also kept on disk for a day, so they survive app restarts
+CT_CACHE_DIR = os.path.join(".cache", "clinicaltrials")
+CT_CACHE_TTL = 24 * 3600
+
+def _ct_cache_path(condition):
+    return os.path.join(CT_CACHE_DIR, f"{blake2b(condition.encode()).hexdigest()}.json")
+
+def _read_ct_cache(condition):
+    path = _ct_cache_path(condition)
+    try:
+        if time.time() - os.path.getmtime(path) < CT_CACHE_TTL:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass  # Missing, stale or unreadable entries are fetched again
+    return None
+
+# When expired entries were last removed; sweeping once per TTL keeps writes cheap
+_ct_cache_pruned = 0.0
+
+def _prune_ct_cache():
+    global _ct_cache_pruned
+    now = time.time()
+    if now - _ct_cache_pruned < CT_CACHE_TTL:
+        return
+    _ct_cache_pruned = now
+    try:
+        for entry in os.scandir(CT_CACHE_DIR):
+            if now - entry.stat().st_mtime >= CT_CACHE_TTL:
+                os.remove(entry.path)
+    except FileNotFoundError:
+        pass  # Nothing cached yet, or another thread removed the entry first
+    except OSError as e:
+        print(f"⚠️ ClinicalTrials.gov cache prune error: {e}")
+
+def _write_ct_cache(condition, study_info):
+    path = _ct_cache_path(condition)
+    try:
+        os.makedirs(CT_CACHE_DIR, exist_ok=True)
+        # The page batch and a single lookup can store the same condition at once,
+        # so each writer gets its own temp file
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=CT_CACHE_DIR,
+                                         suffix=".tmp", delete=False) as f:
+            json.dump(study_info, f)
+        os.replace(f.name, path)
+    except Exception as e:
+        print(f"⚠️ ClinicalTrials.gov cache write error: {e}")
+    _prune_ct_cache()
+
+def _get_studies(search_params):
+    with _CT_SLOTS:
+        # Small jitter so prefetches and lookups from several sessions do not arrive in lockstep
+        time.sleep(random.uniform(0.05, 0.2))
+        search_r = _SESSION.get(CT_API_URL, params=search_params, timeout=(3, 10))
+    search_r.raise_for_status()
+    return search_r.json().get("studies", [])
+
+def _study_info(s):
+    protocol = s["protocolSection"]
+    nct_id = protocol["identificationModule"]["nctId"]
+    title = protocol["identificationModule"]["briefTitle"]
+    phase = ", ".join(protocol.get("designModule", {}).get("phases", [])) or "N/A"
+    status = protocol.get("statusModule", {}).get("overallStatus", "N/A")
+    ct_link = f"https://clinicaltrials.gov/study/{nct_id}"
+    # Contacts and sites come back in the same response, so no per-study follow-up requests
+    contacts_locations = protocol.get("contactsLocationsModule", {})
+    contacts = [
+        " ".join(filter(None, [c.get("name"), f"({c['email']})" if c.get("email") else None]))
+        for c in contacts_locations.get("centralContacts", [])
+    ]
+    locations = [
+        ", ".join(filter(None, [loc.get("facility"), loc.get("city"), loc.get("country")]))
+        for loc in contacts_locations.get("locations", [])[:CT_MAX_LOCATIONS]
+    ]
+
+    return {
+        "nct_id": nct_id,
+        "title": title,
+        "phase": phase,
+        "status": status,
+        "link": ct_link,
+        "contacts": [c for c in contacts if c],
+        "locations": [loc for loc in locations if loc]
+    }
+
+def _fetch_clinicaltrials_gov(condition):
+    search_params = {
+        "query.cond": condition,
+        "query.term": "gene therapy",
+        "fields": CT_FIELDS,
+        "pageSize": CT_PAGE_SIZE,
+        "format": "json"
+    }
+    return [_study_info(s) for s in _get_studies(search_params)]
+
+# Memoized per condition: registry sheets repeat the same condition across many rows.
+# Failed lookups raise out of the cached function, so they are retried next time.
+@st.cache_data(ttl=3600, show_spinner=False)
+def _query_clinicaltrials_gov(condition):
+    study_info = _read_ct_cache(condition)
+    if study_info is None:
+        study_info = _fetch_clinicaltrials_gov(condition)
+        _write_ct_cache(condition, study_info)
+    return tuple(study_info)
+
+def prefetch_clinicaltrials_gov(conditions):
+    """Look up several upcoming conditions in one request and cache those it fully answers."""
+    todo = sorted(c for c in set(conditions) if _read_ct_cache(c) is None)
+    if len(todo) < 2:
+        return  # A single condition is no cheaper batched than through the normal lookup
+
+    search_params = {
+        "query.cond": " OR ".join('"' + c.replace('"', "") + '"' for c in todo),
+        "query.term": "gene therapy",
+        "fields": f"{CT_FIELDS},Condition",
+        "pageSize": 100,
+        "format": "json"
+    }
+    try:
+        studies = _get_studies(search_params)
+    except Exception as e:
+        print(f"⚠️ ClinicalTrials.gov batch API error: {e}")
+        return
+
+    # Hand each study to the batch conditions it lists. Only exact names count: a substring
+    # test would give "SMA" the plasma cell studies and "MPS I" those of MPS II and III.
+    matched = {c: [] for c in todo}
+    for s in studies:
+        listed = {_lc(x) for x in s["protocolSection"].get("conditionsModule", {}).get("conditions", [])}
+        for c in todo:
+            if len(matched[c]) < CT_PAGE_SIZE and _lc(c) in listed:
+                matched[c].append(_study_info(s))
+
+    # Fewer hits than a full page may only mean the condition was crowded out of the batch,
+    # so those conditions are left to their own lookup
+    for c, study_info in matched.items():
+        if len(study_info) == CT_PAGE_SIZE:
+            _write_ct_cache(c, study_info)
+
+def check_clinicaltrials_gov(condition):
+    try:
+        return list(_query_clinicaltrials_gov(condition))
+    except Exception as e:
+        print(f"⚠️ ClinicalTrials.gov API error for {condition}: {e}")
+        return []
+
+# -------------------------------
+# 4. CGT relevance logic
+# -------------------------------
+_CGT_KEYWORDS = ("cell therapy", "gene therapy", "crispr", "talen", "zfn", "gene editing", "gene correction", "gene silencing", "reprogramming")
+# Every keyword contains one of the stems, so most texts are rejected after a few scans
+_CGT_STEMS = ("gene", "cell", "crispr", "talen", "zfn", "reprogramming")
+
+def has_cgt_keyword(text_lower):
+    return any(t in text_lower for t in _CGT_STEMS) and any(k in text_lower for k in _CGT_KEYWORDS)
+
+# Qualifier tails registries append to a condition name: ", classic", "(severe)", " - adult", "type 2"
+_QUALIFIER_TAIL_RE = re.compile(r"\s*(?:[,;:(]|\s-\s|\btype\s+\w+\b).*$")
+
+def lookup_cgt_map(condition_lower):
+    relevance = cgt_map.get(condition_lower)
+    if relevance is None:
+        # Only a recognised qualifier is dropped; a bare prefix match would map "hemophilia c"
+        # or "beta thalassemia trait" onto a different condition
+        relevance = cgt_map.get(_QUALIFIER_TAIL_RE.sub("", condition_lower, count=1))
+    return relevance or "Unsure"
+
+def needs_ct_lookup(condition_lower):
+    """Whether a condition's relevance still depends on ClinicalTrials.gov."""
+    # Approved products and a "Relevant" mapping already settle it without the API
+    return bool(condition_lower) and condition_lower not in approved_cgt_map \
+        and lookup_cgt_map(condition_lower) != "Relevant"
+
+# Not cached itself: the ClinicalTrials.gov query underneath is, and a failed query must not be
+# remembered here as a mapping-only answer
+def assess_cgt_relevance_and_links(condition, keyword_hit):
+    links = []
+    condition_lower = _lc(condition)
+    # Escaped once for every search link; blank cells come through as NA
+    q = quote_plus(condition) if condition_lower else ""
+
+    # FDA/EMA approved CGT check
+    approved_products = approved_cgt_map.get(condition_lower, [])
+    if approved_products:
+        relevance = "Relevant"
+        for p in approved_products:
+            links.append({
+                "title": f"{p['approved_product']} Approved by {p['agency']} ({p['approval_year']})",
+                "link": f"https://www.google.com/search?q={quote_plus(p['approved_product'])}+{quote_plus(p['agency'])}+approval",
+                "phase": "Approved",
+                "status": "Approved",
+                "contacts": [],
+                "locations": []
+            })
+    else:
+        # Check ClinicalTrials.gov
+        studies = check_clinicaltrials_gov(condition) if needs_ct_lookup(condition_lower) else []
+        if studies:
+            relevance = "Relevant"
+            links.extend(studies)
+        else:
+            # Check preclinical research
+            relevance = lookup_cgt_map(condition_lower)
+            if relevance == "Relevant":
+                # Mapped conditions skip the API, so leave the reviewer a way to browse trials
+                links.append({
+                    "title": "ClinicalTrials.gov Search",
+                    "link": f"https://clinicaltrials.gov/search?cond={q}&term=gene+therapy",
+                    "phase": "N/A",
+                    "status": "N/A",
+                    "contacts": [],
+                    "locations": []
+                })
+            elif relevance == "Likely Relevant":
+                links.append({
+                    "title": "Preclinical research identified",
+                    "link": f"https://pubmed.ncbi.nlm.nih.gov/?term={q}+gene+therapy",
+                    "phase": "Preclinical",
+                    "status": "N/A",
+                    "contacts": [],
+                    "locations": []
+                })
+
+    if relevance == "Unsure":
+        if keyword_hit:
+            relevance = "Likely Relevant"
+
+    # Add general PubMed search
+    links.append({
+        "title": "PubMed Search",
+        "link": f"https://pubmed.ncbi.nlm.nih.gov/?term={q}+gene+therapy",
+        "phase": "N/A",
+        "status": "N/A",
+        "contacts": [],
+        "locations": []
+    })
+
+    return relevance, links
+
+# -------------------------------
+# 5. Email extractor
+# -------------------------------
+# Domain labels cannot contain dots, so the address pattern never backtracks across them
+_EMAIL_ADDR = rb"[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,24}"
+# mailto: targets must be a real address; "?subject=" tails and placeholders are skipped
+_MAILTO_RE = re.compile(rb'href\s*=\s*["\']mailto:(' + _EMAIL_ADDR + rb')', re.I)
+# The lookbehind only lets a match start at the beginning of a run of address characters,
+# so a failed search stays linear in the page size
+_EMAIL_RE = re.compile(rb"(?<![A-Za-z0-9._%+-])" + _EMAIL_ADDR)
+# A contact address, if present, sits well within the first 256 KB of markup
+_EMAIL_MAX_BYTES = 256 * 1024
+_EMAIL_CHUNK_BYTES = 16 * 1024
+# Re-scan this much of the previous chunk so a mailto: link split across chunks is still seen
+_MAILTO_OVERLAP = 512
+# Total time allowed for one page, however slowly it trickles in
+_EMAIL_DEADLINE = 8
+
+# Registry sites get their own session with no status retries: waiting out a 503 and its
+# Retry-After would hold a lookup worker that every session shares.
+# Some of these sites are still served over plain HTTP.
+_EMAIL_SESSION = requests.Session()
+_EMAIL_SESSION.headers["Accept-Encoding"] = "gzip, deflate"
+_EMAIL_ADAPTER = HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=1, status=0, respect_retry_after_header=False)
+)
+_EMAIL_SESSION.mount("https://", _EMAIL_ADAPTER)
+_EMAIL_SESSION.mount("http://", _EMAIL_ADAPTER)
+
+# Cached like the ClinicalTrials.gov query: fetch errors raise out and are not remembered
+@st.cache_data(ttl=3600, show_spinner=False)
+def _fetch_email(url):
+    # The timeouts bound each socket read; the deadline bounds the whole page, so a site
+    # sending a few bytes at a time cannot keep the fetch going
+    deadline = time.monotonic() + _EMAIL_DEADLINE
+    with _EMAIL_SESSION.get(url, timeout=(3, 5), stream=True,
+                            headers={"Range": f"bytes=0-{_EMAIL_MAX_BYTES - 1}"}) as r:
+        body = bytearray()
+        while time.monotonic() < deadline:
+            # read1 (urllib3 2.3+) returns whatever has arrived instead of waiting for a full chunk
+            chunk = r.raw.read1(_EMAIL_CHUNK_BYTES, decode_content=True)
+            if not chunk:
+                break
+            start = max(0, len(body) - _MAILTO_OVERLAP)
+            body += chunk
+            # Stop downloading once a mailto: link shows up; it wins over any plain address
+            if len(body) >= _EMAIL_MAX_BYTES or _MAILTO_RE.search(body, start):
+                break
+    # Scan the raw markup instead of building a DOM for a single anchor
+    m = _MAILTO_RE.search(body)
+    if m:
+        return m.group(1).decode()
+    m = _EMAIL_RE.search(body)
+    return m.group(0).decode() if m else ""
+
+def extract_email(url):
+    try:
+        return _fetch_email(url)
+    except Exception as e:
+        print(f"⚠️ Email extraction error: {e}")
+        return ""
+
+# -------------------------------
+# 6. Per-record lookups
+# -------------------------------
+# Both lookups mostly wait on the network, so a couple of threads are enough to overlap them
+_LOOKUP_POOL = ThreadPoolExecutor(max_workers=4)
+
+def _run_in_ctx(ctx, fn, *args):
+    # st.cache_data looks up the session's script context on the running thread
+    add_script_run_ctx(ctx=ctx)
+    return fn(*args)
+
+def lookup_record(condition, keyword_hit, url):
+    """Run the CGT assessment and the contact email scrape for one record concurrently."""
+    ctx = get_script_run_ctx(suppress_warning=True)
+    cgt = _LOOKUP_POOL.submit(_run_in_ctx, ctx, assess_cgt_relevance_and_links, condition, keyword_hit)
+    email = _LOOKUP_POOL.submit(_run_in_ctx, ctx, extract_email, url)
+    return cgt.result(), email.result()
+
+# Background warm-up of ClinicalTrials.gov lookups. Fewer workers than _CT_SLOTS, so lookups
+# for the record on screen always find a free slot.
+_WARM_POOL = ThreadPoolExecutor(max_workers=4)
+# Conditions this process has already queued for warm-up
+_WARMED = set()
+
+def _warm_page(conditions):
+    prefetch_clinicaltrials_gov(conditions)
+    # Conditions the batch did not fully answer are looked up on their own
+    for c in conditions:
+        check_clinicaltrials_gov(c)
+
+def warm_clinicaltrials_gov(conditions, page):
+    """Queue ClinicalTrials.gov lookups for every distinct condition in the background.
+
+    The conditions of the current page go first, batched into one request.
+    """
+    ctx = get_script_run_ctx(suppress_warning=True)
+    todo = [c for c in conditions.dropna().unique() if c not in _WARMED and needs_ct_lookup(_lc(c))]
+    _WARMED.update(todo)
+    on_page = set(page.dropna())
+    if on_page.intersection(todo):
+        _WARM_POOL.submit(_run_in_ctx, ctx, _warm_page, [c for c in todo if c in on_page])
+    for c in todo:
+        if c not in on_page:
+            _WARM_POOL.submit(_run_in_ctx, ctx, check_clinicaltrials_gov, c)
@@ -1,316 +1,193 @@
-import streamlit as st
-import pandas as pd
-import requests
-from bs4 import BeautifulSoup
-import re
-import json
-
-st.set_page_config(page_title="Clinical Registry Review Tool", layout="wide")
-st.title("🧾 Clinical Registry Review Tool (Final Integrated)")
-
-# -------------------------------
-# 1. Load JSON mapping files
-# -------------------------------
-@st.cache_data
-def load_cgt_mapping():
-    with open("merged_cgt_mapping.json", "r") as f:
-        return json.load(f)
-
-@st.cache_data
-def load_age_mapping():
-    with open("infant_mapping.json", "r") as f:
-        return json.load(f)
-
-@st.cache_data
-def load_approved_cgt():
-    with open("approved_cgt.json", "r") as f:
-        return json.load(f)
-
-cgt_map = load_cgt_mapping()
-age_map = load_age_mapping()
-approved_cgt_map = load_approved_cgt()
-
-# -------------------------------
-# 2. Infant inclusion logic
-# -------------------------------
-def assess_infant_inclusion(text, condition):
-    text_lower = text.lower() if pd.notna(text) else ""
-
-    # 1. Direct inclusion patterns (for Include infants only if upper bound ≤ 2 years)
-    include_patterns = [
-        r"(from|starting at|age)\s*(0|birth|newborn|newborns|infant|infants)",
-        r"(less than|<)\s*(12|18|24|1|2)\s*(months?|years?)",
-        r"up to\s*(12|18|24|1|2)\s*(months?|years?)",
-        r"\bnewborns?\b",
-        r"\binfants?\b"
-    ]
-
-    for pattern in include_patterns:
-        if re.search(pattern, text_lower):
-            return "Include infants"
-
-    # 2. Numeric age ranges
-    age_range_matches = re.findall(
-        r"(\d+)\s*(months?|years?)\s*(to|-)\s*(\d+)\s*(months?|years?)", text_lower
-    )
-
-    for lower_val, lower_unit, _, upper_val, upper_unit in age_range_matches:
-        lower_val = int(lower_val)
-        upper_val = int(upper_val)
-
-        lower_val_in_years = lower_val / 12 if "month" in lower_unit else lower_val
-        upper_val_in_years = upper_val / 12 if "month" in upper_unit else upper_val
-
-        if 0 <= lower_val_in_years <= 2:
-            if upper_val_in_years <= 2:
-                return "Include infants"
-            else:
-                return "Likely to include infants"
-        elif lower_val_in_years > 2:
-            return "Does not include infants"
-
-    # 3. Standalone age fallback
-    standalone_ages = re.findall(r"(\d+)\s*(months?|years?)", text_lower)
-    for val, unit in standalone_ages:
-        val = int(val)
-        val_in_years = val / 12 if "month" in unit else val
-        if 0 <= val_in_years <= 2:
-            return "Likely to include infants"
-        elif val_in_years > 2:
-            return "Does not include infants"
-
-    # 4. Explicit exclusion check
-    if re.search(r"(does not include infants|exclude infants|no infants|not include infants)", text_lower):
-        return "Does not include infants"
-
-    # 5. Age of onset mapping
-    onset = age_map.get(condition.lower(), "").lower()
-    if any(x in onset for x in ["birth", "infant", "neonate", "0-2 years", "0-12 months", "0-24 months"]):
-        return "Likely to include infants"
-    if any(x in onset for x in ["toddler", "child", "3 years", "4 years"]):
-        return "Unlikely to include infants but possible"
-
-    # 6. Default
-    return "Uncertain"
-
-    
-    # 3. Check explicit exclusion keywords
-    if re.search(r"(does not include infants|exclude infants|no infants|not include infants)", text_lower):
-        return "Does not include infants"
-    
-    # 4. Check Age of onset mapping
-    onset = age_map.get(condition.lower(), "").lower()
-    if any(x in onset for x in ["birth", "infant", "neonate", "0-2 years", "0-12 months", "0-24 months"]):
-        return "Likely to include infants"
-    if any(x in onset for x in ["toddler", "child", "3 years", "4 years"]):
-        return "Unlikely to include infants but possible"
-    
-    # 5. If no clues, return uncertain
-    return "Uncertain"
-
-# -------------------------------
-# 3. ClinicalTrials.gov API
-# -------------------------------
-def check_clinicaltrials_gov(condition):
-    try:
-        search_url = "https://clinicaltrials.gov/api/query/study_fields"
-        search_params = {
-            "expr": f"{condition} gene therapy",
-            "fields": "NCTId,BriefTitle,Phase,OverallStatus",
-            "min_rnk": 1,
-            "max_rnk": 3,
-            "fmt": "json"
-        }
-        search_r = requests.get(search_url, params=search_params, timeout=10)
-        search_data = search_r.json()
-        studies = search_data['StudyFieldsResponse']['StudyFields']
-        study_info = []
-
-        for s in studies:
-            nct_id = s["NCTId"][0]
-            title = s["BriefTitle"][0]
-            phase = s.get("Phase", ["N/A"])[0]
-            status = s.get("OverallStatus", ["N/A"])[0]
-            ct_link = f"https://clinicaltrials.gov/ct2/show/{nct_id}"
-
-            study_info.append({
-                "nct_id": nct_id,
-                "title": title,
-                "phase": phase,
-                "status": status,
-                "link": ct_link,
-                "contacts": [],
-                "locations": []
-            })
-        return study_info
-
-    except Exception as e:
-        print(f"⚠️ ClinicalTrials.gov API error for {condition}: {e}")
-        return []
-
-# -------------------------------
-# 4. CGT relevance logic
-# -------------------------------
-def assess_cgt_relevance_and_links(text, condition):
-    links = []
-    condition_lower = condition.lower()
-
-    # FDA/EMA approved CGT check
-    approved_products = [p for p in approved_cgt_map if p["condition"].lower() == condition_lower]
-    if approved_products:
-        relevance = "Relevant"
-        for p in approved_products:
-            links.append({
-                "title": f"{p['approved_product']} Approved by {p['agency']} ({p['approval_year']})",
-                "link": f"https://www.google.com/search?q={p['approved_product']}+{p['agency']}+approval",
-                "phase": "Approved",
-                "status": "Approved",
-                "contacts": [],
-                "locations": []
-            })
-    else:
-        # Check ClinicalTrials.gov
-        studies = check_clinicaltrials_gov(condition)
-        if studies:
-            relevance = "Relevant"
-            links.extend(studies)
-        else:
-            # Check preclinical research
-            relevance = cgt_map.get(condition_lower, "Unsure")
-            if relevance == "Likely Relevant":
-                links.append({
-                    "title": "Preclinical research identified",
-                    "link": f"https://pubmed.ncbi.nlm.nih.gov/?term={condition.replace(' ','+')}+gene+therapy",
-                    "phase": "Preclinical",
-                    "status": "N/A",
-                    "contacts": [],
-                    "locations": []
-                })
-
-    if relevance == "Unsure":
-        cgt_keywords = ["cell therapy", "gene therapy", "crispr", "talen", "zfn", "gene editing", "gene correction", "gene silencing", "reprogramming"]
-        text_lower = text.lower() if pd.notna(text) else ""
-        if any(k in text_lower for k in cgt_keywords):
-            relevance = "Likely Relevant"
-
-    # Add general PubMed search
-    links.append({
-        "title": "PubMed Search",
-        "link": f"https://pubmed.ncbi.nlm.nih.gov/?term={condition.replace(' ','+')}+gene+therapy",
-        "phase": "N/A",
-        "status": "N/A",
-        "contacts": [],
-        "locations": []
-    })
-
-    return relevance, links
-
-# -------------------------------
-# 5. Email extractor
-# -------------------------------
-def extract_email(url):
-    try:
-        r = requests.get(url, timeout=8)
-        soup = BeautifulSoup(r.text, 'html.parser')
-        mail = soup.select_one("a[href^=mailto]")
-        if mail:
-            return mail['href'].replace('mailto:', '')
-        matches = re.findall(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,4}", soup.get_text())
-        return matches[0] if matches else ""
-    except Exception as e:
-        print(f"⚠️ Email extraction error: {e}")
-        return ""
-
-# -------------------------------
-# 6. Streamlit app flow
-# -------------------------------
-uploaded_file = st.file_uploader("📂 Upload registry Excel", type=["xlsx"])
-
-if uploaded_file:
-    if "df" not in st.session_state:
-        df = pd.read_excel(uploaded_file, engine="openpyxl")
-        st.session_state.df = df.copy()
-    else:
-        df = st.session_state.df
-
-    reviewer_name = st.text_input("Your name (Column F)", "")
-    df_filtered = df[df["Reviewer"].str.strip().str.lower() == reviewer_name.strip().lower()].copy()
-
-    show_incomplete = st.checkbox("Show only incomplete rows", value=True)
-    if show_incomplete:
-        df_filtered = df_filtered[df_filtered["Population (use drop down list)"].isna() | df_filtered["Relevance to C&GT"].isna()]
-
-    if df_filtered.empty:
-        st.success("🎉 All done, no incomplete rows.")
-    else:
-        record_index = st.number_input("Select row", 0, len(df_filtered)-1, step=1)
-        record = df_filtered.iloc[record_index]
-        condition = record["Conditions"]
-
-        st.subheader("🔎 Record Details")
-        st.markdown(f"**Condition:** {condition}")
-        st.markdown(f"**Study Title:** {record['Study Title']}")
-        st.markdown(f"[🔗 Open Registry Link]({record['Web site']})")
-
-        study_texts = " ".join([
-            str(record.get("Population (use drop down list)", "")),
-            str(record.get("Conditions", "")),
-            str(record.get("Study Title", "")),
-            str(record.get("Brief Summary", ""))
-        ])
-
-        suggested_infant = assess_infant_inclusion(study_texts, condition)
-        st.caption(f"🧒 Suggested: **{suggested_infant}**")
-
-        suggested_cgt, study_links = assess_cgt_relevance_and_links(study_texts, condition)
-        st.caption(f"🧬 Suggested: **{suggested_cgt}**")
-
-        if study_links:
-            st.markdown("🔗 **Related Studies & Database Links:**")
-            for s in study_links:
-                st.markdown(f"- **{s['title']}** (Phase: {s['phase']}, Status: {s['status']}) [View Study]({s['link']})")
-                if s['contacts']:
-                    st.markdown(f"  **Contacts:** {', '.join(s['contacts'])}")
-                if s['locations']:
-                    st.markdown(f"  **Locations:** {', '.join(s['locations'])}")
-
-        email = st.text_input("Contact email", extract_email(record["Web site"]))
-
-        pop_choice = st.radio("Infant Population", [
-            "Include infants",
-            "Likely to include infants",
-            "Unlikely to include infants but possible",
-            "Does not include infants",
-            "Uncertain"
-        ], index=0)
-
-        cg_choice = st.radio("Cell/Gene Therapy Relevance", [
-            "Relevant",
-            "Likely Relevant",
-            "Unlikely Relevant",
-            "Not Relevant",
-            "Unsure"
-        ], index=0)
-
-        comments = st.text_area("Reviewer Comments", value=record.get(
-            "Reviewer Notes (comments to support the relevance to the infant population that needs C&GT)", ""))
-
-        if st.button("💾 Save"):
-            original_index = df_filtered.index[record_index]
-            df.at[original_index, "contact information"] = email
-            df.at[original_index, "Population (use drop down list)"] = pop_choice if pop_choice != "Uncertain" else suggested_infant
-            df.at[original_index, "Relevance to C&GT"] = cg_choice if cg_choice != "Unsure" else suggested_cgt
-            df.at[original_index, "Reviewer Notes (comments to support the relevance to the infant population that needs C&GT)"] = comments
-            st.session_state.df = df.copy()
-            st.success("✅ Record saved successfully!")
-
-        if st.button("⬇️ Export Updated Excel"):
-            output_filename = "updated_registry_review.xlsx"
-            df.to_excel(output_filename, index=False)
-            with open(output_filename, "rb") as f:
-                st.download_button(
-                    label="⬇️ Download Updated Registry",
-                    data=f,
-                    file_name=output_filename,
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+import streamlit as st
+import pandas as pd
+import os
+import time
+from hashlib import blake2b
+from io import BytesIO
+
+from analysis import precompute_suggestions, warm_clinicaltrials_gov, lookup_record
+
+st.set_page_config(page_title="Clinical Registry Review Tool", layout="wide")
+st.title("🧾 Clinical Registry Review Tool (Final Integrated)")
+
+# -------------------------------
+# Streamlit app flow
+# -------------------------------
+# Text columns the review flow reads or writes; everything else is passed through untouched
+REGISTRY_TEXT_COLS = [
+    "Reviewer",
+    "Conditions",
+    "Study Title",
+    "Web site",
+    "Brief Summary",
+    "Population (use drop down list)",
+    "Relevance to C&GT",
+    "contact information",
+    "Reviewer Notes (comments to support the relevance to the infant population that needs C&GT)"
+]
+# Helper columns derived at upload time; dropped again on export
+DERIVED_COLS = ["_reviewer_norm", "_incomplete", "_study_text", "_suggested_infant", "_cgt_keyword"]
+# Records per page whose ClinicalTrials.gov lookups are batched into one request
+CT_PREFETCH_PAGE = 20
+# Parsed uploads are kept here as Parquet, named by a hash of the workbook bytes
+CACHE_DIR = ".cache"
+# Cached uploads not opened for this long are deleted
+CACHE_MAX_AGE = 7 * 24 * 3600
+# Parsed uploads held in memory across all sessions
+CACHE_MAX_UPLOADS = 8
+
+def mark_incomplete(df):
+    df["_incomplete"] = df["Population (use drop down list)"].isna() | df["Relevance to C&GT"].isna()
+
+def prune_registry_cache():
+    cutoff = time.time() - CACHE_MAX_AGE
+    try:
+        for entry in os.scandir(CACHE_DIR):
+            if entry.name.endswith(".parquet") and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+    except FileNotFoundError:
+        pass  # Nothing cached yet
+    except OSError as e:
+        print(f"⚠️ Registry cache prune error: {e}")
+
+@st.cache_data(max_entries=CACHE_MAX_UPLOADS)
+def load_registry(key, _data):
+    path = os.path.join(CACHE_DIR, f"{key}.parquet")
+    if os.path.exists(path):
+        df = pd.read_parquet(path, dtype_backend="pyarrow")
+        # Opening a cached upload keeps it from being pruned
+        os.utime(path)
+    else:
+        prune_registry_cache()
+        df = pd.read_excel(
+            BytesIO(_data),
+            engine="calamine",
+            dtype={c: str for c in REGISTRY_TEXT_COLS}
+        ).convert_dtypes(dtype_backend="pyarrow")
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            df.to_parquet(f"{path}.tmp", compression="zstd")
+            os.replace(f"{path}.tmp", path)
+        except Exception as e:
+            # Columns mixing numbers and text cannot be stored as Parquet; just skip caching
+            print(f"⚠️ Registry cache write error: {e}")
+
+    # Derived columns stay out of the Parquet file so mapping updates take effect.
+    # Few distinct reviewers across many rows: filter on integer category codes
+    # Unassigned rows stay NA, so the empty name box does not match them
+    df["_reviewer_norm"] = df["Reviewer"].str.strip().str.casefold().astype("category")
+    mark_incomplete(df)
+    precompute_suggestions(df)
+    return df
+
+uploaded_file = st.file_uploader("📂 Upload registry Excel", type=["xlsx"])
+
+if uploaded_file:
+    if "df" not in st.session_state:
+        data = uploaded_file.getvalue()
+        df = load_registry(blake2b(data).hexdigest(), data)
+        # st.cache_data already hands each caller its own copy
+        st.session_state.df = df
+    else:
+        df = st.session_state.df
+    # Saved reviews are staged here as {(row_index, column): value} and applied to df on export
+    pending_edits = st.session_state.setdefault("pending_edits", {})
+
+    reviewer_name = st.text_input("Your name (Column F)", "")
+    df_filtered = df[df["_reviewer_norm"] == reviewer_name.strip().casefold()]
+
+    show_incomplete = st.checkbox("Show only incomplete rows", value=True)
+    if show_incomplete:
+        staged_rows = list({i for i, _ in pending_edits})
+        df_filtered = df_filtered[df_filtered["_incomplete"] & ~df_filtered.index.isin(staged_rows)]
+
+    if df_filtered.empty:
+        st.success("🎉 All done, no incomplete rows.")
+    else:
+        record_index = st.number_input("Select row", 0, len(df_filtered)-1, step=1)
+        record = df_filtered.iloc[record_index]
+        original_index = df_filtered.index[record_index]
+        condition = record["Conditions"]
+
+        st.subheader("🔎 Record Details")
+        st.markdown(f"**Condition:** {condition}")
+        st.markdown(f"**Study Title:** {record['Study Title']}")
+        st.markdown(f"[🔗 Open Registry Link]({record['Web site']})")
+
+        suggested_infant = record["_suggested_infant"]
+        st.caption(f"🧒 Suggested: **{suggested_infant}**")
+
+        # Fetch the reviewer's studies in the background while this record is reviewed. The
+        # page is aligned so stepping through records sends one batch per page, not one per record.
+        page_start = record_index - record_index % CT_PREFETCH_PAGE
+        warm_clinicaltrials_gov(df_filtered["Conditions"], df_filtered["Conditions"].iloc[page_start:page_start + CT_PREFETCH_PAGE])
+        (suggested_cgt, study_links), scraped_email = lookup_record(condition, record["_cgt_keyword"], record["Web site"])
+        st.caption(f"🧬 Suggested: **{suggested_cgt}**")
+
+        if study_links:
+            st.markdown("🔗 **Related Studies & Database Links:**")
+            for s in study_links:
+                st.markdown(f"- **{s['title']}** (Phase: {s['phase']}, Status: {s['status']}) [View Study]({s['link']})")
+                if s['contacts']:
+                    st.markdown(f"  **Contacts:** {', '.join(s['contacts'])}")
+                if s['locations']:
+                    st.markdown(f"  **Locations:** {', '.join(s['locations'])}")
+
+        # Widgets inside the form only rerun the script on Save, not on every change
+        with st.form("record"):
+            email = st.text_input("Contact email", scraped_email)
+
+            pop_choice = st.radio("Infant Population", [
+                "Include infants",
+                "Likely to include infants",
+                "Unlikely to include infants but possible",
+                "Does not include infants",
+                "Uncertain"
+            ], index=0)
+
+            cg_choice = st.radio("Cell/Gene Therapy Relevance", [
+                "Relevant",
+                "Likely Relevant",
+                "Unlikely Relevant",
+                "Not Relevant",
+                "Unsure"
+            ], index=0)
+
+            notes_col = "Reviewer Notes (comments to support the relevance to the infant population that needs C&GT)"
+            saved_notes = pending_edits.get((original_index, notes_col), record.get(notes_col))
+            comments = st.text_area("Reviewer Comments", value="" if pd.isna(saved_notes) else saved_notes)
+
+            if st.form_submit_button("💾 Save"):
+                for col, val in [
+                    ("contact information", email),
+                    ("Population (use drop down list)", pop_choice if pop_choice != "Uncertain" else suggested_infant),
+                    ("Relevance to C&GT", cg_choice if cg_choice != "Unsure" else suggested_cgt),
+                    (notes_col, comments)
+                ]:
+                    pending_edits[(original_index, col)] = val
+                st.success("✅ Record saved successfully!")
+
+        if st.button("⬇️ Export Updated Excel"):
+            if pending_edits:
+                edits = pd.Series(pending_edits).unstack()
+                # update() only fills existing columns, so add any the sheet lacks
+                for col in edits.columns.difference(df.columns):
+                    df[col] = pd.Series(dtype="string[pyarrow]")
+                # Apply all staged saves in one aligned update
+                df.update(edits)
+                pending_edits.clear()
+                mark_incomplete(df)
+            output = BytesIO()
+            # Keep URLs as plain text: xlsxwriter drops every URL past its 65,530-hyperlink limit
+            with pd.ExcelWriter(
+                output,
+                engine="xlsxwriter",
+                engine_kwargs={"options": {"strings_to_urls": False}}
+            ) as writer:
+                df.drop(columns=DERIVED_COLS).to_excel(writer, index=False)
+            st.download_button(
+                label="⬇️ Download Updated Registry",
+                data=output.getvalue(),
+                file_name="updated_registry_review.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# analysis.py opens its JSON mappings relative to the working directory, as it does under streamlit run
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
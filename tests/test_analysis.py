@@ -0,0 +1,91 @@
+import itertools
+import json
+import re
+
+import pandas as pd
+import pytest
+
+import analysis
+
+# -------------------------------
+# Reference: the original one-record-at-a-time rules
+# -------------------------------
+with open("infant_mapping.json", "r") as f:
+    REF_AGE_MAP = {k.lower(): v for k, v in json.load(f).items()}
+
+REF_INCLUDE_PATTERNS = [
+    r"(?:from|starting at|age)\s*(?:0|birth|newborn|newborns|infant|infants)",
+    r"(?:less than|<)\s*(?:12|18|24|1|2)\s*(?:months?|years?)",
+    r"up to\s*(?:12|18|24|1|2)\s*(?:months?|years?)",
+    r"\bnewborns?\b",
+    r"\binfants?\b"
+]
+
+def reference_infant_inclusion(text_lower, condition):
+    for pattern in REF_INCLUDE_PATTERNS:
+        if re.search(pattern, text_lower):
+            return "Include infants"
+
+    age_range_matches = re.findall(
+        r"(\d+)\s*(months?|years?)\s*(to|-)\s*(\d+)\s*(months?|years?)", text_lower
+    )
+    for lower_val, lower_unit, _, upper_val, upper_unit in age_range_matches:
+        lower_val_in_years = int(lower_val) / 12 if "month" in lower_unit else int(lower_val)
+        upper_val_in_years = int(upper_val) / 12 if "month" in upper_unit else int(upper_val)
+        if 0 <= lower_val_in_years <= 2:
+            if upper_val_in_years <= 2:
+                return "Include infants"
+            return "Likely to include infants"
+        elif lower_val_in_years > 2:
+            return "Does not include infants"
+
+    for val, unit in re.findall(r"(\d+)\s*(months?|years?)", text_lower):
+        val_in_years = int(val) / 12 if "month" in unit else int(val)
+        if 0 <= val_in_years <= 2:
+            return "Likely to include infants"
+        elif val_in_years > 2:
+            return "Does not include infants"
+
+    if re.search(r"(does not include infants|exclude infants|no infants|not include infants)", text_lower):
+        return "Does not include infants"
+
+    onset = REF_AGE_MAP.get(condition.lower(), "").lower()
+    if any(x in onset for x in ["birth", "infant", "neonate", "0-2 years", "0-12 months", "0-24 months"]):
+        return "Likely to include infants"
+    if any(x in onset for x in ["toddler", "child", "3 years", "4 years"]):
+        return "Unlikely to include infants but possible"
+    return "Uncertain"
+
+# -------------------------------
+# Representative registry phrasing
+# -------------------------------
+TEXTS = [
+    "", "nan nan nan nan", "children from birth up to 2 years", "patients 6 months to 5 years",
+    "adults 18 years and older", "does not include infants", "exclude infants", "no infants 5 years",
+    "age 0 to 17", "from 0", "starting at newborn", "less than 12 months", "< 2 years", "up to 24 months",
+    "newborns", "infant", "infantile", "2 years - 10 years", "1 year to 2 years", "24 months-36 months",
+    "3 months", "30 months", "ages 5 years", "age 2", "the 0-2 group", "treated at 12 month",
+    "up to 18 years", "from birth", "age  infants", "12 years to 17 years and 3 months",
+    "5 years 1 month to 2 years", "100 months", "x" * 50 + " 7 years", "phase 1 2020",
+    "less than 1 year old", "up to 1 month", "<18 months", "newbornscreening", "3 years-6 months",
+    "0 months to 6 months", "less than 2 months", "up to 3 years", "age 1", "crispr gene therapy",
+    # Non-ASCII digits still count as ages
+    "٣ years", "１２ months", "٢ years to ٥ years", "6 months - １８ months", "patients ১০ years and older",
+]
+CONDITIONS = ["Spinal Muscular Atrophy", "Duchenne Muscular Dystrophy", "Rett Syndrome", "Cystic Fibrosis", "unknown", ""]
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_include_patterns_match_reference(text):
+    expected = any(re.search(p, text) for p in REF_INCLUDE_PATTERNS)
+    assert bool(analysis._INCLUDE_RE.search(text)) == expected
+
+def test_classify_infant_inclusion_matches_reference():
+    cases = list(itertools.product(TEXTS, CONDITIONS))
+    text_lower = pd.Series([t for t, _ in cases], dtype="string[pyarrow]")
+    conditions = pd.Series([c for _, c in cases], dtype="string[pyarrow]")
+
+    got = analysis.classify_infant_inclusion(text_lower, conditions)
+
+    expected = [reference_infant_inclusion(t, c) for t, c in cases]
+    mismatches = [(t, c, e, g) for (t, c), e, g in zip(cases, expected, got) if e != g]
+    assert not mismatches